@@ -1,21 +1,30 @@
 from dotenv import load_dotenv
+import asyncio
 import logging
 import os
+import re
+import threading
+import time
 from typing import Optional
 import datetime
+import io
+from zoneinfo import ZoneInfo
 from livekit import agents
-from livekit.agents import JobContext, WorkerOptions, AgentSession, Agent, RunContext, function_tool, RoomInputOptions
-from livekit.plugins import deepgram, openai, cartesia, silero, noise_cancellation, elevenlabs, google
+from livekit.agents import JobContext, JobProcess, WorkerOptions, AgentSession, Agent, RunContext, function_tool, RoomInputOptions
+from livekit.plugins import deepgram, openai, cartesia, silero, noise_cancellation
+import google_auth_httplib2
+from dateutil import parser as dateutil_parser
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.http import build_http
 from supabase import create_client, Client
 
 
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging (set LOG_LEVEL=DEBUG for caller ID diagnostics)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
 # Business configuration
@@ -27,16 +36,150 @@ ELEVEN_API_KEY = os.getenv("ELEVEN_API_KEY")
 # Google Calendar configuration
 CALENDAR_ID = os.getenv("CALENDAR_ID", "primary")
 GOOGLE_CREDENTIALS_FILE = os.getenv("GOOGLE_CREDENTIALS_FILE", "credentials.json")
+CALENDAR_SCOPES = ('https://www.googleapis.com/auth/calendar',)
 DEFAULT_MEETING_DURATION = int(os.getenv("DEFAULT_MEETING_DURATION", "60"))
+TIMEZONE = ZoneInfo("America/New_York")
 
 # Supabase configuration
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SK")  # Use secret key for backend operations
 
-SYSTEM_INSTRUCTIONS = f"""You are a professional legal receptionist for {BUSINESS_NAME}.
+# Supabase client, shared by every call handled in this worker
+_SUPABASE_ENABLED = bool(SUPABASE_URL and SUPABASE_KEY)
+_SUPABASE: Optional[Client] = create_client(SUPABASE_URL, SUPABASE_KEY) if _SUPABASE_ENABLED else None
+if not _SUPABASE_ENABLED:
+    logger.warning("SUPABASE_URL/SUPABASE_SK not set, call history will not be recorded")
+
+# Strong references to in-flight call history writes so they aren't garbage collected
+_pending_writes: set[asyncio.Task] = set()
+
+# Caller ID patterns (compiled once, reused for every call)
+_ROOM_PHONE_RE = re.compile(r'_(?P<strict>\+\d{11,15})_|(?P<loose>\+\d{11,15})', re.ASCII)
+_PARTICIPANT_PHONE_RE = re.compile(r'(\+?1?\d{10,15})', re.ASCII)  # identity and metadata
+
+# Non-ISO date/time layouts the LLM commonly produces, tried before falling back to dateutil
+_DATE_TIME_FORMATS = (
+    "%Y-%m-%d %I:%M %p",
+    "%Y-%m-%d %I:%M%p",
+    "%Y-%m-%d %I %p",
+    "%Y-%m-%d %I%p",
+)
+
+
+def parse_date_time(value: str) -> datetime.datetime:
+    """Parse a date/time from the LLM, trying exact formats before the (slow) generic dateutil parser."""
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    for fmt in _DATE_TIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return dateutil_parser.parse(value)
+
+
+# Google Calendar client, shared by every call handled in this worker
+_calendar_credentials = None
+_calendar_service = None
+_calendar_service_lock = threading.Lock()
+_calendar_http = threading.local()
+
+# Short-lived cache of FreeBusy results, keyed by (calendar_id, time_min, time_max)
+_BUSY_CACHE_TTL = 30.0  # seconds
+_BUSY_CACHE_MAX_ENTRIES = 256
+_busy_cache: dict[tuple[str, str, str], tuple[float, list[tuple[datetime.datetime, datetime.datetime]]]] = {}
+
+
+def get_calendar_service():
+    """Initialize (once per process) and return the Google Calendar service."""
+    global _calendar_credentials, _calendar_service
+    if _calendar_service is None:
+        with _calendar_service_lock:
+            if _calendar_service is None:
+                _calendar_credentials = service_account.Credentials.from_service_account_file(
+                    GOOGLE_CREDENTIALS_FILE,
+                    scopes=CALENDAR_SCOPES
+                )
+                _calendar_service = build(
+                    'calendar', 'v3',
+                    credentials=_calendar_credentials,
+                    cache_discovery=False,
+                    static_discovery=True,
+                )
+    return _calendar_service
+
+
+async def get_calendar_service_async():
+    """Like get_calendar_service, but builds the service off the event loop on first use."""
+    if _calendar_service is not None:
+        return _calendar_service
+    return await asyncio.to_thread(get_calendar_service)
+
+
+def _execute_calendar_request(request):
+    """Execute a Calendar API request on an HTTP connection owned by the current thread."""
+    # httplib2 connections are not thread-safe, so each executor thread keeps its own
+    http = getattr(_calendar_http, 'http', None)
+    if http is None:
+        http = google_auth_httplib2.AuthorizedHttp(_calendar_credentials, http=build_http())
+        _calendar_http.http = http
+    return request.execute(http=http)
+
+
+async def execute_calendar_request(request):
+    """Run a blocking Calendar API request without stalling the event loop."""
+    return await asyncio.to_thread(_execute_calendar_request, request)
+
+
+async def get_busy_intervals(
+    time_min: datetime.datetime,
+    time_max: datetime.datetime
+) -> list[tuple[datetime.datetime, datetime.datetime]]:
+    """Return the sorted busy (start, end) intervals on the calendar between time_min and time_max."""
+    key = (CALENDAR_ID, time_min.isoformat(), time_max.isoformat())
+    cached = _busy_cache.get(key)
+    if cached is not None and time.monotonic() - cached[0] < _BUSY_CACHE_TTL:
+        return cached[1]
+
+    service = await get_calendar_service_async()
+    result = await execute_calendar_request(service.freebusy().query(body={
+        'timeMin': time_min.isoformat(),
+        'timeMax': time_max.isoformat(),
+        'timeZone': TIMEZONE.key,
+        'items': [{'id': CALENDAR_ID}],
+    }))
+
+    calendar = result['calendars'][CALENDAR_ID]
+    if calendar.get('errors'):
+        raise RuntimeError(f"FreeBusy query failed for {CALENDAR_ID}: {calendar['errors']}")
+
+    # fromisoformat accepts a trailing 'Z' on Python 3.11+; convert so times are
+    # read out in the business timezone whatever offset Google replies with
+    intervals = sorted(
+        (
+            datetime.datetime.fromisoformat(busy['start']).astimezone(TIMEZONE),
+            datetime.datetime.fromisoformat(busy['end']).astimezone(TIMEZONE),
+        )
+        for busy in calendar.get('busy', [])
+    )
 
-IMPORTANT: Today's date is {datetime.datetime.now().strftime('%Y-%m-%d')} ({datetime.datetime.now().strftime('%A, %B %d, %Y')}).
-When scheduling appointments, always use the year 2025 unless the caller explicitly specifies a different year.
+    # Evict the oldest entry (dicts keep insertion order) once the cache is full
+    _busy_cache.pop(key, None)
+    if len(_busy_cache) >= _BUSY_CACHE_MAX_ENTRIES:
+        del _busy_cache[next(iter(_busy_cache))]
+    _busy_cache[key] = (time.monotonic(), intervals)
+    return intervals
+
+
+def invalidate_busy_cache():
+    """Drop cached FreeBusy results, e.g. after booking a new event."""
+    _busy_cache.clear()
+
+
+# Static part of the prompt; kept byte-identical across calls so the LLM provider's prefix cache can hit
+SYSTEM_INSTRUCTIONS = f"""You are a professional legal receptionist for {BUSINESS_NAME}.
 
 Your role is to:
 - Answer calls professionally with appropriate legal office formality
@@ -71,31 +214,42 @@ For general messages (NOT scheduling): Use take_message only for non-scheduling
 Start each call by greeting the caller: "Thank you for calling {BUSINESS_NAME}, how may I assist you today?"
 """
 
+GREETING_INSTRUCTIONS = f"Greet the caller: 'Thank you for calling {BUSINESS_NAME}, how may I assist you today?'"
+
+
+def date_instructions() -> str:
+    """Volatile part of the prompt, built per call and appended after the static prefix."""
+    now = datetime.datetime.now(TIMEZONE)
+    return f"""
+IMPORTANT: Today's date is {now.strftime('%Y-%m-%d')} ({now.strftime('%A, %B %d, %Y')}).
+When scheduling appointments, always use the year {now.year} unless the caller explicitly specifies a different year.
+"""
+
 
 class ReceptionistAgent(Agent):
     def __init__(self):
-        super().__init__(instructions=SYSTEM_INSTRUCTIONS)
+        super().__init__(instructions=SYSTEM_INSTRUCTIONS + date_instructions())
         self.caller_phone = None
         self.caller_name = None
         self.meeting_date = None
-        self._calendar_service = None
         self.call_start_time = datetime.datetime.now()
-        self.call_notes = []  # Track important events during the call
+        self._notes_buf = io.StringIO()  # Track important events during the call, "; "-separated
 
     def add_note(self, note: str):
         """Add a note to the call history."""
-        self.call_notes.append(note)
+        if self._notes_buf.tell():
+            self._notes_buf.write("; ")
+        self._notes_buf.write(note)
         logger.info(f"Call note added: {note}")
 
-    def _get_calendar_service(self):
-        """Initialize and return Google Calendar service."""
-        if self._calendar_service is None:
-            credentials = service_account.Credentials.from_service_account_file(
-                GOOGLE_CREDENTIALS_FILE,
-                scopes=['https://www.googleapis.com/auth/calendar']
-            )
-            self._calendar_service = build('calendar', 'v3', credentials=credentials)
-        return self._calendar_service
+    @property
+    def call_notes(self) -> str:
+        """All notes recorded during the call, joined with '; '."""
+        return self._notes_buf.getvalue()
+
+    async def _get_calendar_service(self):
+        """Return the worker-wide Google Calendar service."""
+        return await get_calendar_service_async()
 
     @function_tool()
     async def get_business_hours(self, ctx: RunContext) -> str:
@@ -113,41 +267,27 @@ class ReceptionistAgent(Agent):
         logger.info(f"Checking availability for {date}")
 
         try:
-            service = self._get_calendar_service()
-
             # Parse the date and create time range for the day
-            target_date = datetime.datetime.fromisoformat(date)
-            time_min = target_date.replace(hour=0, minute=0, second=0).isoformat() + 'Z'
-            time_max = target_date.replace(hour=23, minute=59, second=59).isoformat() + 'Z'
+            target_date = datetime.datetime.fromisoformat(date).replace(tzinfo=TIMEZONE)
+            if target_date.date() < datetime.datetime.now(TIMEZONE).date():
+                return "That date has already passed. Could you provide a future date?"
 
-            # Fetch events for the day
-            events_result = service.events().list(
-                calendarId=CALENDAR_ID,
-                timeMin=time_min,
-                timeMax=time_max,
-                singleEvents=True,
-                orderBy='startTime'
-            ).execute()
+            time_min = target_date.replace(hour=0, minute=0, second=0)
+            time_max = target_date.replace(hour=23, minute=59, second=59)
 
-            events = events_result.get('items', [])
+            # Fetch busy intervals for the day in a single FreeBusy query
+            busy_intervals = await get_busy_intervals(time_min, time_max)
 
-            if not events:
+            if not busy_intervals:
                 return f"The calendar is completely free on {date}. What time would work best for you?"
 
             # Build response with busy times
-            response = f"On {date}, the following times are already booked:\n"
-            for event in events:
-                start = event['start'].get('dateTime', event['start'].get('date'))
-                end = event['end'].get('dateTime', event['end'].get('date'))
-
-                # Parse and format times
-                start_time = datetime.datetime.fromisoformat(start.replace('Z', '+00:00'))
-                end_time = datetime.datetime.fromisoformat(end.replace('Z', '+00:00'))
+            lines = [f"On {date}, the following times are already booked:"]
+            for start_time, end_time in busy_intervals:
+                lines.append(f"- {start_time.strftime('%I:%M %p')} to {end_time.strftime('%I:%M %p')}")
 
-                response += f"- {start_time.strftime('%I:%M %p')} to {end_time.strftime('%I:%M %p')}\n"
-
-            response += "\nWhat time would you prefer for your appointment?"
-            return response
+            lines.append("\nWhat time would you prefer for your appointment?")
+            return "\n".join(lines)
 
         except HttpError as error:
             logger.error(f"Calendar API error: {error}")
@@ -177,15 +317,22 @@ class ReceptionistAgent(Agent):
         logger.info(f"Scheduling appointment for {caller_name} at {date_time}")
 
         try:
-            service = self._get_calendar_service()
-
             # Parse the start time
-            start_time = datetime.datetime.fromisoformat(date_time)
+            start_time = parse_date_time(date_time)
+            now = datetime.datetime.now(TIMEZONE)
+            if start_time < (now if start_time.tzinfo else now.replace(tzinfo=None)):
+                return "That time has already passed. Could you provide a future date and time?"
+
+            service = await self._get_calendar_service()
+
             end_time = start_time + datetime.timedelta(minutes=DEFAULT_MEETING_DURATION)
 
             # Use caller_phone if phone_number not provided
             contact_phone = phone_number or self.caller_phone
 
+            # Invite the caller only when they gave an email address as their name
+            attendees = [{'email': caller_name}] if '@' in caller_name else []
+
             # Create event
             event = {
                 'summary': f'Meeting with {caller_name}',
@@ -198,9 +345,7 @@ class ReceptionistAgent(Agent):
                     'dateTime': end_time.isoformat(),
                     'timeZone': 'America/New_York',
                 },
-                'attendees': [
-                    {'email': caller_name if '@' in caller_name else None}
-                ] if '@' in caller_name else [],
+                'attendees': attendees,
                 'reminders': {
                     'useDefault': False,
                     'overrides': [
@@ -210,10 +355,11 @@ class ReceptionistAgent(Agent):
                 },
             }
 
-            created_event = service.events().insert(
+            created_event = await execute_calendar_request(service.events().insert(
                 calendarId=CALENDAR_ID,
                 body=event
-            ).execute()
+            ))
+            invalidate_busy_cache()
 
             logger.info(f"Event created: {created_event.get('htmlLink')}")
 
@@ -279,15 +425,15 @@ async def write_call_history_to_supabase(
     phone_number: Optional[str],
     caller_name: Optional[str],
     meeting_date: Optional[str],
-    notes: list[str]
+    notes: str
 ):
     """Write call history to Supabase call_history table."""
-    try:
-        # Initialize Supabase client
-        supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    if _SUPABASE is None:
+        logger.warning("Supabase is not configured, skipping call history write")
+        return
 
-        # Combine notes into a single string
-        notes_text = "; ".join(notes) if notes else "No specific notes"
+    try:
+        notes_text = notes or "No specific notes"
 
         # Prepare data for insertion
         call_data = {
@@ -300,7 +446,9 @@ async def write_call_history_to_supabase(
         logger.info(f"Writing call history to Supabase: {call_data}")
 
         # Insert into call_history table
-        result = supabase.table("call_history").insert(call_data).execute()
+        result = await asyncio.to_thread(
+            lambda: _SUPABASE.table("call_history").insert(call_data).execute()
+        )
 
         logger.info(f"✓ Call history written successfully: {result}")
 
@@ -308,8 +456,20 @@ async def write_call_history_to_supabase(
         logger.error(f"Failed to write call history to Supabase: {e}")
 
 
+async def flush_call_history():
+    """Wait for background call history writes to finish."""
+    if _pending_writes:
+        await asyncio.gather(*_pending_writes, return_exceptions=True)
+
+
+def prewarm(proc: JobProcess):
+    """Load models once per worker process so calls don't pay for it."""
+    proc.userdata["vad"] = silero.VAD.load()
+
+
 async def entrypoint(ctx: JobContext):
     logger.info(f"Starting receptionist agent for room: {ctx.room.name}")
+    ctx.add_shutdown_callback(flush_call_history)
 
     # Create custom agent instance
     receptionist_agent = ReceptionistAgent()
@@ -317,57 +477,64 @@ async def entrypoint(ctx: JobContext):
     # Extract caller phone number from room name or participant metadata
     caller_phone = None
     try:
-        logger.info(f"=== CALLER ID EXTRACTION ===" )
-        logger.info(f"Room name: '{ctx.room.name}'")
-        logger.info(f"Remote participants count: {len(ctx.room.remote_participants) if ctx.room.remote_participants else 0}")
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug("=== CALLER ID EXTRACTION ===")
+            logger.debug("Room name: '%s'", ctx.room.name)
+            logger.debug("Remote participants count: %d", len(ctx.room.remote_participants) if ctx.room.remote_participants else 0)
 
         # Method 1: Check room name for caller info when coming from SIP
-        import re
-        phone_match = re.search(r'_(\+\d{11,15})_', ctx.room.name)
-        if phone_match:
-            caller_phone = phone_match.group(1)
-            logger.info(f"✓ Extracted caller phone from room name: {caller_phone}")
+        # Single scan: a strict `_+number_` match wins over the first bare number
+        fallback_phone = None
+        for phone_match in _ROOM_PHONE_RE.finditer(ctx.room.name):
+            if phone_match.group('strict'):
+                caller_phone = phone_match.group('strict')
+                logger.debug("✓ Extracted caller phone from room name: %s", caller_phone)
+                break
+            if fallback_phone is None:
+                fallback_phone = phone_match.group('loose')
         else:
-            # Fallback: try broader pattern
-            phone_match = re.search(r'(\+\d{11,15})', ctx.room.name)
-            if phone_match:
-                caller_phone = phone_match.group(1)
-                logger.info(f"✓ Extracted caller phone from room name (fallback): {caller_phone}")
+            if fallback_phone:
+                caller_phone = fallback_phone
+                logger.debug("✓ Extracted caller phone from room name (fallback): %s", caller_phone)
 
         # Method 2: Check for participants and their metadata (for SIP headers)
         if ctx.room.remote_participants:
             for i, participant in enumerate(ctx.room.remote_participants.values()):
-                logger.info(f"--- Participant {i+1} ---")
-                logger.info(f"Identity: '{participant.identity}'")
-                logger.info(f"Metadata: '{participant.metadata}'")
+                if debug:
+                    logger.debug("--- Participant %d ---", i + 1)
+                    logger.debug("Identity: '%s'", participant.identity)
+                    logger.debug("Metadata: '%s'", participant.metadata)
 
                 # Check participant identity for phone number
                 if hasattr(participant, 'identity') and participant.identity:
-                    phone_match = re.search(r'(\+?1?\d{10,15})', participant.identity)
+                    phone_match = _PARTICIPANT_PHONE_RE.search(participant.identity)
                     if phone_match:
                         caller_phone = phone_match.group(1)
-                        logger.info(f"✓ Extracted caller phone from participant identity: {caller_phone}")
+                        logger.debug("✓ Extracted caller phone from participant identity: %s", caller_phone)
                         break
 
                 # Check participant metadata if available
                 if hasattr(participant, 'metadata') and participant.metadata:
-                    if 'X-From' in str(participant.metadata) or 'from' in str(participant.metadata).lower():
-                        phone_match = re.search(r'(\+?1?\d{10,15})', str(participant.metadata))
+                    metadata = str(participant.metadata)
+                    # Matches 'X-From' headers as well as any other 'from' field
+                    if 'from' in metadata.lower():
+                        phone_match = _PARTICIPANT_PHONE_RE.search(metadata)
                         if phone_match:
                             caller_phone = phone_match.group(1)
-                            logger.info(f"✓ Extracted caller phone from participant metadata: {caller_phone}")
+                            logger.debug("✓ Extracted caller phone from participant metadata: %s", caller_phone)
                             break
         else:
-            logger.info("No remote participants found yet")
+            logger.debug("No remote participants found yet")
 
         # Set caller phone on the agent if found
         if caller_phone:
             receptionist_agent.caller_phone = caller_phone
-            logger.info(f"✓ Auto-populated caller phone: {caller_phone}")
+            logger.info("✓ Auto-populated caller phone: %s", caller_phone)
         else:
             logger.info("❌ No caller phone number detected")
 
-        logger.info(f"=== END CALLER ID EXTRACTION ===")
+        logger.debug("=== END CALLER ID EXTRACTION ===")
 
     except Exception as e:
         logger.warning(f"Could not extract caller phone number: {e}")
@@ -397,7 +564,11 @@ async def entrypoint(ctx: JobContext):
         #     voice_id="cNYrMw9glwJZXR8RwbuR",
         #     model="eleven_multilingual_v2"
         # ),
-        vad=silero.VAD.load(),
+        vad=ctx.proc.userdata["vad"],
+        # Start LLM inference on partial transcripts while end-of-turn is still being confirmed
+        preemptive_generation=True,
+        min_endpointing_delay=0.1,
+        max_endpointing_delay=3.0,
     )
 
     # Start the session with the custom agent
@@ -410,22 +581,22 @@ async def entrypoint(ctx: JobContext):
     )
 
     # Generate initial greeting
-    await session.generate_reply(
-        instructions=f"Greet the caller: 'Thank you for calling {BUSINESS_NAME}, how may I assist you today?'"
-    )
+    await session.generate_reply(instructions=GREETING_INSTRUCTIONS)
 
     # Register callback to write to Supabase when call ends
-    @ctx.room.on("participant_disconnected")
-    def on_disconnect(participant):
-        logger.info("Participant disconnected, writing to Supabase...")
-        import asyncio
-        asyncio.create_task(write_call_history_to_supabase(
-            phone_number=receptionist_agent.caller_phone,
-            caller_name=receptionist_agent.caller_name,
-            meeting_date=receptionist_agent.meeting_date,
-            notes=receptionist_agent.call_notes
-        ))
+    if _SUPABASE_ENABLED:
+        @ctx.room.on("participant_disconnected")
+        def on_disconnect(participant):
+            logger.info("Participant disconnected, writing to Supabase...")
+            task = asyncio.get_running_loop().create_task(write_call_history_to_supabase(
+                phone_number=receptionist_agent.caller_phone,
+                caller_name=receptionist_agent.caller_name,
+                meeting_date=receptionist_agent.meeting_date,
+                notes=receptionist_agent.call_notes
+            ))
+            _pending_writes.add(task)
+            task.add_done_callback(_pending_writes.discard)
 
 
 if __name__ == "__main__":
-    agents.cli.run_app(WorkerOptions(entrypoint_fnc=entrypoint, agent_name="inbound-agent"))
+    agents.cli.run_app(WorkerOptions(entrypoint_fnc=entrypoint, prewarm_fnc=prewarm, agent_name="inbound-agent"))
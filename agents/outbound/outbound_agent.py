@@ -5,12 +5,17 @@ import logging
 import os
 import json
 import datetime
+import threading
+import time
+from dataclasses import dataclass, fields
 from typing import Optional, Dict, Any
+from zoneinfo import ZoneInfo
 from dotenv import load_dotenv
 
 from livekit import agents, api, rtc
 from livekit.agents import (
     JobContext,
+    JobProcess,
     WorkerOptions,
     AgentSession,
     Agent,
@@ -21,15 +26,17 @@ from livekit.agents import (
     RoomInputOptions
 )
 from livekit.plugins import deepgram, openai, cartesia, silero, google
+import google_auth_httplib2
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.http import build_http
 from supabase import create_client, Client
 
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging (set LOG_LEVEL=DEBUG for SIP request details)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger("outbound-reminder-agent")
 
 # Business configuration
@@ -42,16 +49,111 @@ twilio_caller_id = os.getenv("TWILIO_CALLER_ID")
 # Google Calendar configuration
 CALENDAR_ID = os.getenv("CALENDAR_ID", "primary")
 GOOGLE_CREDENTIALS_FILE = os.getenv("GOOGLE_CREDENTIALS_FILE", "credentials.json")
+CALENDAR_SCOPES = ('https://www.googleapis.com/auth/calendar',)
 DEFAULT_MEETING_DURATION = int(os.getenv("DEFAULT_MEETING_DURATION", "60"))
+TIMEZONE = ZoneInfo("America/New_York")
+SLOTS_CACHE_TTL = 60.0  # seconds to reuse a day's events within a call
+TIME_FORMAT = '%I:%M %p'  # How booked times are read back to the customer
 
 # Supabase configuration
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SK")  # Use secret key for backend operations
 
-OUTBOUND_SYSTEM_INSTRUCTIONS = f"""You are calling customers on behalf of {BUSINESS_NAME} to follow up on missed appointments.
 
-IMPORTANT: Today's date is {datetime.datetime.now().strftime('%Y-%m-%d')} ({datetime.datetime.now().strftime('%A, %B %d, %Y')}).
-When scheduling appointments, always use the year 2025 unless the caller explicitly specifies a different year.
+@dataclass(slots=True, frozen=True)
+class MeetingData:
+    """Missed-meeting details passed in the job metadata at agent dispatch."""
+    phone_number: Optional[str] = None
+    customer_name: Optional[str] = 'the customer'
+    meeting_date: Optional[str] = 'your scheduled time'
+    meeting_time: Optional[str] = ''
+    meeting_purpose: Optional[str] = 'your meeting'
+    sip_trunk_id: Optional[str] = None
+    caller_id: Optional[str] = None
+
+    @classmethod
+    def from_metadata(cls, data: Dict[str, Any]) -> MeetingData:
+        """Build from decoded job metadata, ignoring keys this agent doesn't use."""
+        if not isinstance(data, dict):
+            raise ValueError(f"Job metadata must be a JSON object, got {type(data).__name__}")
+        known = {f.name for f in fields(cls)}
+        return cls(**{key: value for key, value in data.items() if key in known})
+
+
+def format_booked_times(events: list) -> list[str]:
+    """Format each calendar event as a '- <start> to <end>' line."""
+    lines = []
+    for event in events:
+        start = event['start'].get('dateTime', event['start'].get('date'))
+        end = event['end'].get('dateTime', event['end'].get('date'))
+
+        # Parse and format times (fromisoformat accepts a trailing 'Z' on Python 3.11+)
+        start_time = datetime.datetime.fromisoformat(start)
+        end_time = datetime.datetime.fromisoformat(end)
+
+        lines.append(f"- {start_time.strftime(TIME_FORMAT)} to {end_time.strftime(TIME_FORMAT)}")
+    return lines
+
+
+# Supabase client, shared by every call handled in this worker
+_SUPABASE_ENABLED = bool(SUPABASE_URL and SUPABASE_KEY)
+_SUPABASE: Optional[Client] = create_client(SUPABASE_URL, SUPABASE_KEY) if _SUPABASE_ENABLED else None
+if not _SUPABASE_ENABLED:
+    logger.warning("SUPABASE_URL/SUPABASE_SK not set, call history will not be recorded")
+
+# Strong references to in-flight call history writes so they aren't garbage collected
+_pending_writes: set[asyncio.Task] = set()
+
+# Google Calendar client, shared by every call handled in this worker
+_calendar_credentials = None
+_calendar_service = None
+_calendar_service_lock = threading.Lock()
+_calendar_http = threading.local()
+
+
+def get_calendar_service():
+    """Initialize (once per process) and return the Google Calendar service."""
+    global _calendar_credentials, _calendar_service
+    if _calendar_service is None:
+        with _calendar_service_lock:
+            if _calendar_service is None:
+                _calendar_credentials = service_account.Credentials.from_service_account_file(
+                    GOOGLE_CREDENTIALS_FILE,
+                    scopes=CALENDAR_SCOPES
+                )
+                _calendar_service = build(
+                    'calendar', 'v3',
+                    credentials=_calendar_credentials,
+                    cache_discovery=False,
+                    static_discovery=True,
+                )
+    return _calendar_service
+
+
+async def get_calendar_service_async():
+    """Like get_calendar_service, but builds the service off the event loop on first use."""
+    if _calendar_service is not None:
+        return _calendar_service
+    return await asyncio.to_thread(get_calendar_service)
+
+
+def _execute_calendar_request(request):
+    """Execute a Calendar API request on an HTTP connection owned by the current thread."""
+    # httplib2 connections are not thread-safe, so each executor thread keeps its own
+    http = getattr(_calendar_http, 'http', None)
+    if http is None:
+        http = google_auth_httplib2.AuthorizedHttp(_calendar_credentials, http=build_http())
+        _calendar_http.http = http
+    return request.execute(http=http)
+
+
+async def execute_calendar_request(request):
+    """Run a blocking Calendar API request without stalling the event loop."""
+    return await asyncio.to_thread(_execute_calendar_request, request)
+
+
+# Static part of the prompt; kept byte-identical across calls so the LLM provider's prefix cache can hit
+OUTBOUND_SYSTEM_INSTRUCTIONS = f"""You are calling customers on behalf of {BUSINESS_NAME} to follow up on missed appointments.
 
 Your role is to:
 - Politely inform customers they missed their scheduled appointment
@@ -78,6 +180,7 @@ IMPORTANT CONVERSATION BEHAVIOR:
 - State the purpose clearly and provide original meeting details
 - If customer wants to reschedule, collect their preferred date/time and use schedule_appointment() to book it on the calendar
 - You can optionally use get_available_slots() to check availability for a specific date
+- If the customer suggests several possible dates, check them together with get_available_slots_multi()
 - DO NOT ask for phone number - it is automatically detected from the call
 
 Keep conversations SHORT and to the point. Most calls should be under 2 minutes.
@@ -88,21 +191,31 @@ Business Info:
 """
 
 
+def date_instructions() -> str:
+    """Volatile part of the prompt, built per call and appended after the static prefix."""
+    now = datetime.datetime.now(TIMEZONE)
+    return f"""
+IMPORTANT: Today's date is {now.strftime('%Y-%m-%d')} ({now.strftime('%A, %B %d, %Y')}).
+When scheduling appointments, always use the year {now.year} unless the caller explicitly specifies a different year.
+"""
+
+
 class OutboundReminderAgent(Agent):
-    def __init__(self, meeting_data: Dict[str, Any]):
-        super().__init__(instructions=OUTBOUND_SYSTEM_INSTRUCTIONS)
+    def __init__(self, meeting_data: MeetingData):
+        super().__init__(instructions=OUTBOUND_SYSTEM_INSTRUCTIONS + date_instructions())
         self.meeting_data = meeting_data
         self.call_completed = False
         self.voicemail_detected = False
-        self._calendar_service = None
+        self._history_written = False  # Call history is recorded once per call
+        self._slots_cache: dict[str, tuple[float, list]] = {}  # date -> (fetched at, events)
         self.call_notes = []  # Track important events during the call
 
         # Parse meeting information from metadata
-        self.customer_phone = meeting_data.get('phone_number', 'Unknown')
-        self.customer_name = meeting_data.get('customer_name', 'the customer')
-        self.meeting_date = meeting_data.get('meeting_date', 'your scheduled time')
-        self.meeting_time = meeting_data.get('meeting_time', '')
-        self.meeting_purpose = meeting_data.get('meeting_purpose', 'your meeting')
+        self.customer_phone = meeting_data.phone_number or 'Unknown'
+        self.customer_name = meeting_data.customer_name
+        self.meeting_date = meeting_data.meeting_date
+        self.meeting_time = meeting_data.meeting_time
+        self.meeting_purpose = meeting_data.meeting_purpose
         self.new_meeting_date = None  # Will store rescheduled meeting time
 
         # Keep reference to participant for call management
@@ -115,15 +228,44 @@ class OutboundReminderAgent(Agent):
         self.call_notes.append(note)
         logger.info(f"Call note added: {note}")
 
-    def _get_calendar_service(self):
-        """Initialize and return Google Calendar service."""
-        if self._calendar_service is None:
-            credentials = service_account.Credentials.from_service_account_file(
-                GOOGLE_CREDENTIALS_FILE,
-                scopes=['https://www.googleapis.com/auth/calendar']
+    async def _get_calendar_service(self):
+        """Return the worker-wide Google Calendar service."""
+        return await get_calendar_service_async()
+
+    async def _finalize(
+        self,
+        ctx: RunContext,
+        *,
+        note: str,
+        meeting_date: Optional[str],
+        wait_playout: bool = True
+    ):
+        """Add a closing note, record call history in the background, and hang up."""
+        self.add_note(note)
+        if not self._history_written:
+            self._history_written = True
+            record_call_history(
+                phone_number=self.customer_phone,
+                caller_name=self.customer_name,
+                meeting_date=meeting_date,
+                notes=self.call_notes
             )
-            self._calendar_service = build('calendar', 'v3', credentials=credentials)
-        return self._calendar_service
+
+        if wait_playout:
+            await ctx.wait_for_playout()
+        await self.hangup()
+
+    async def write_pending_history(self):
+        """Write call history at job shutdown if the call ended without an exit tool recording it."""
+        if self._history_written or not self.call_notes:
+            return
+        self._history_written = True
+        await write_call_history_to_supabase(
+            phone_number=self.customer_phone,
+            caller_name=self.customer_name,
+            meeting_date=self.new_meeting_date,
+            notes=self.call_notes
+        )
 
     def set_participant(self, participant: rtc.RemoteParticipant):
         self.participant = participant
@@ -137,6 +279,74 @@ class OutboundReminderAgent(Agent):
             )
         )
 
+    @staticmethod
+    def _events_list_request(service, target_date: datetime.datetime):
+        """Build the events.list request covering target_date."""
+        target_date = target_date.replace(tzinfo=TIMEZONE)
+        time_min = target_date.replace(hour=0, minute=0, second=0).isoformat()
+        time_max = target_date.replace(hour=23, minute=59, second=59).isoformat()
+        return service.events().list(
+            calendarId=CALENDAR_ID,
+            timeMin=time_min,
+            timeMax=time_max,
+            timeZone=TIMEZONE.key,
+            singleEvents=True,
+            orderBy='startTime',
+            fields='items(start/dateTime,start/date,end/dateTime,end/date)'  # Only the fields we read
+        )
+
+    async def _list_events_for_dates(self, target_dates: list[datetime.datetime]) -> dict[str, list]:
+        """
+        Return the calendar events for each date, keyed by YYYY-MM-DD.
+
+        Recent results from this call are reused; the remaining dates are fetched
+        together in a single batched HTTP request.
+        """
+        now = time.monotonic()
+        results: dict[str, list] = {}
+        missing: dict[str, datetime.datetime] = {}
+        for target_date in target_dates:
+            key = target_date.date().isoformat()
+            cached = self._slots_cache.get(key)
+            if cached is not None and now - cached[0] < SLOTS_CACHE_TTL:
+                results[key] = cached[1]
+            else:
+                missing[key] = target_date
+
+        if not missing:
+            return results
+
+        service = await self._get_calendar_service()
+        if len(missing) == 1:
+            key, target_date = next(iter(missing.items()))
+            events_result = await execute_calendar_request(self._events_list_request(service, target_date))
+            results[key] = events_result.get('items', [])
+        else:
+            errors = []
+
+            def on_response(request_id, response, exception):
+                if exception is not None:
+                    errors.append(exception)
+                else:
+                    results[request_id] = response.get('items', [])
+
+            batch = service.new_batch_http_request(callback=on_response)
+            for key, target_date in missing.items():
+                batch.add(self._events_list_request(service, target_date), request_id=key)
+            await execute_calendar_request(batch)
+            if errors:
+                raise errors[0]
+
+        fetched_at = time.monotonic()
+        for key in missing:
+            self._slots_cache[key] = (fetched_at, results[key])
+        return results
+
+    async def _list_events_for_date(self, target_date: datetime.datetime) -> list:
+        """Return the calendar events on target_date, reusing a recent result from this call."""
+        events_by_date = await self._list_events_for_dates([target_date])
+        return events_by_date[target_date.date().isoformat()]
+
     @function_tool()
     async def get_meeting_details(self, ctx: RunContext) -> str:
         """Get the original missed meeting details to share with the customer if they ask"""
@@ -162,41 +372,50 @@ class OutboundReminderAgent(Agent):
         logger.info(f"Checking availability for {date}")
 
         try:
-            service = self._get_calendar_service()
-
-            # Parse the date and create time range for the day
-            target_date = datetime.datetime.fromisoformat(date)
-            time_min = target_date.replace(hour=0, minute=0, second=0).isoformat() + 'Z'
-            time_max = target_date.replace(hour=23, minute=59, second=59).isoformat() + 'Z'
-
             # Fetch events for the day
-            events_result = service.events().list(
-                calendarId=CALENDAR_ID,
-                timeMin=time_min,
-                timeMax=time_max,
-                singleEvents=True,
-                orderBy='startTime'
-            ).execute()
-
-            events = events_result.get('items', [])
+            events = await self._list_events_for_date(datetime.datetime.fromisoformat(date))
 
             if not events:
                 return f"The calendar is completely free on {date}. What time would work best for you?"
 
             # Build response with busy times
-            response = f"On {date}, the following times are already booked:\n"
-            for event in events:
-                start = event['start'].get('dateTime', event['start'].get('date'))
-                end = event['end'].get('dateTime', event['end'].get('date'))
+            lines = [f"On {date}, the following times are already booked:"]
+            lines.extend(format_booked_times(events))
+            lines.append("\nWhat time would you prefer for your appointment?")
+            return "\n".join(lines)
 
-                # Parse and format times
-                start_time = datetime.datetime.fromisoformat(start.replace('Z', '+00:00'))
-                end_time = datetime.datetime.fromisoformat(end.replace('Z', '+00:00'))
+        except HttpError as error:
+            logger.error(f"Calendar API error: {error}")
+            return "I'm having trouble accessing the calendar right now. Let me take your preferred time and we'll confirm availability shortly."
+        except Exception as e:
+            logger.error(f"Error checking availability: {e}")
+            return "I'm having trouble checking availability. What time works best for you and we'll confirm it?"
 
-                response += f"- {start_time.strftime('%I:%M %p')} to {end_time.strftime('%I:%M %p')}\n"
+    @function_tool()
+    async def get_available_slots_multi(
+        self,
+        ctx: RunContext,
+        dates: list[str]
+    ) -> str:
+        """Check available time slots for several dates at once. Each date should be in format YYYY-MM-DD."""
+        logger.info(f"Checking availability for {', '.join(dates)}")
 
-            response += "\nWhat time would you prefer for your appointment?"
-            return response
+        try:
+            # Fetch events for all days in a single batched request
+            target_dates = [datetime.datetime.fromisoformat(date) for date in dates]
+            events_by_date = await self._list_events_for_dates(target_dates)
+
+            # Build response with busy times per day
+            lines = []
+            for date, target_date in zip(dates, target_dates):
+                events = events_by_date[target_date.date().isoformat()]
+                if not events:
+                    lines.append(f"The calendar is completely free on {date}.")
+                else:
+                    lines.append(f"On {date}, the following times are already booked:")
+                    lines.extend(format_booked_times(events))
+            lines.append("\nWhich date and time would you prefer for your appointment?")
+            return "\n".join(lines)
 
         except HttpError as error:
             logger.error(f"Calendar API error: {error}")
@@ -210,20 +429,14 @@ class OutboundReminderAgent(Agent):
         """Call this when customer confirms they will attend the meeting"""
         logger.info("Customer confirmed they will attend the meeting")
         self.call_completed = True
-        self.add_note("Confirmed attendance for original appointment")
 
-        # Write to Supabase before ending call
-        await write_call_history_to_supabase(
-            phone_number=self.customer_phone,
-            caller_name=self.customer_name,
-            meeting_date=self.meeting_date,  # Keep original meeting date
-            notes=self.call_notes
+        # End the call after confirmation, keeping the rescheduled date if one was booked
+        await self._finalize(
+            ctx,
+            note="Confirmed attendance for rescheduled appointment" if self.new_meeting_date else "Confirmed attendance for original appointment",
+            meeting_date=self.new_meeting_date or self.meeting_date
         )
 
-        # End the call after confirmation
-        await ctx.wait_for_playout()
-        await self.hangup()
-
         return "Great! We look forward to seeing you. Thank you!"
 
     @function_tool()
@@ -243,7 +456,7 @@ class OutboundReminderAgent(Agent):
         logger.info(f"Rescheduling appointment for {self.customer_name} at {date_time}")
 
         try:
-            service = self._get_calendar_service()
+            service = await self._get_calendar_service()
 
             # Parse the start time
             start_time = datetime.datetime.fromisoformat(date_time)
@@ -273,10 +486,11 @@ class OutboundReminderAgent(Agent):
                 },
             }
 
-            created_event = service.events().insert(
+            created_event = await execute_calendar_request(service.events().insert(
                 calendarId=CALENDAR_ID,
                 body=event
-            ).execute()
+            ))
+            self._slots_cache.pop(start_time.date().isoformat(), None)
 
             logger.info(f"Event created: {created_event.get('htmlLink')}")
 
@@ -285,15 +499,9 @@ class OutboundReminderAgent(Agent):
             logger.info(f"✓ New meeting date set for call history: {self.new_meeting_date}")
 
             formatted_time = start_time.strftime('%A, %B %d at %I:%M %p')
-            self.add_note(f"Rescheduled from {self.meeting_date} to {formatted_time}. Purpose: {meeting_purpose}")
 
-            # Write to Supabase with new meeting date
-            await write_call_history_to_supabase(
-                phone_number=self.customer_phone,
-                caller_name=self.customer_name,
-                meeting_date=self.new_meeting_date,  # Use new rescheduled date
-                notes=self.call_notes
-            )
+            # Call history (with the new meeting date) is written once, when the call ends
+            self.add_note(f"Rescheduled from {self.meeting_date} to {formatted_time}. Purpose: {meeting_purpose}")
 
             return f"Perfect! I've rescheduled your appointment for {formatted_time}. You should receive a confirmation shortly. Is there anything else I can help you with?"
 
@@ -310,19 +518,15 @@ class OutboundReminderAgent(Agent):
         logger.info("Voicemail detected by agent - hanging up immediately")
         self.voicemail_detected = True
         self.call_completed = True
-        self.add_note("Voicemail detected - no answer")
 
-        # Write to Supabase before ending call
-        await write_call_history_to_supabase(
-            phone_number=self.customer_phone,
-            caller_name=self.customer_name,
-            meeting_date=None,  # No new meeting date for voicemail
-            notes=self.call_notes
+        # Hang up immediately without leaving any message; no meeting date for voicemail
+        await self._finalize(
+            ctx,
+            note="Voicemail detected - no answer",
+            meeting_date=None,
+            wait_playout=False
         )
 
-        # Hang up immediately without leaving any message
-        await self.hangup()
-
         return "Voicemail detected - hung up immediately"
 
     @function_tool()
@@ -330,21 +534,15 @@ class OutboundReminderAgent(Agent):
         """Call this when the conversation is complete and customer is informed"""
         logger.info("Call completed successfully")
         self.call_completed = True
-        self.add_note("Call completed successfully")
 
-        # Write to Supabase before ending call
+        # Wait for final message to play out, then hang up
         # Use new_meeting_date if rescheduled, otherwise None
-        await write_call_history_to_supabase(
-            phone_number=self.customer_phone,
-            caller_name=self.customer_name,
-            meeting_date=self.new_meeting_date,  # Will be None if not rescheduled
-            notes=self.call_notes
+        await self._finalize(
+            ctx,
+            note="Call completed successfully",
+            meeting_date=self.new_meeting_date
         )
 
-        # Wait for final message to play out, then hang up
-        await ctx.wait_for_playout()
-        await self.hangup()
-
         return "Thank you! Have a great day!"
 
 
@@ -355,10 +553,11 @@ async def write_call_history_to_supabase(
     notes: list[str]
 ):
     """Write call history to Supabase call_history table."""
-    try:
-        # Initialize Supabase client
-        supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    if _SUPABASE is None:
+        logger.warning("Supabase is not configured, skipping call history write")
+        return
 
+    try:
         # Combine notes into a single string
         notes_text = "; ".join(notes) if notes else "No specific notes"
 
@@ -373,7 +572,9 @@ async def write_call_history_to_supabase(
         logger.info(f"Writing call history to Supabase: {call_data}")
 
         # Insert into call_history table
-        result = supabase.table("call_history").insert(call_data).execute()
+        result = await asyncio.to_thread(
+            lambda: _SUPABASE.table("call_history").insert(call_data).execute()
+        )
 
         logger.info(f"✓ Call history written successfully: {result}")
 
@@ -381,18 +582,46 @@ async def write_call_history_to_supabase(
         logger.error(f"Failed to write call history to Supabase: {e}")
 
 
+def record_call_history(
+    phone_number: Optional[str],
+    caller_name: Optional[str],
+    meeting_date: Optional[str],
+    notes: list[str]
+):
+    """Write call history in the background so callers don't wait on Supabase."""
+    if not _SUPABASE_ENABLED:
+        return
+    task = asyncio.create_task(write_call_history_to_supabase(
+        phone_number=phone_number,
+        caller_name=caller_name,
+        meeting_date=meeting_date,
+        notes=notes
+    ))
+    _pending_writes.add(task)
+    task.add_done_callback(_pending_writes.discard)
+
+
+async def flush_call_history():
+    """Wait for background call history writes to finish."""
+    if _pending_writes:
+        await asyncio.gather(*_pending_writes, return_exceptions=True)
+
+
+def prewarm(proc: JobProcess):
+    """Load models once per worker process so calls don't pay for it."""
+    proc.userdata["vad"] = silero.VAD.load()
+
+
 async def entrypoint(ctx: JobContext):
     logger.info(f"connecting to room {ctx.room.name}")
+    ctx.add_shutdown_callback(flush_call_history)
     await ctx.connect()
 
     # Extract meeting data from job metadata (passed from agent dispatch)
-    meeting_data = {}
-    phone_number = None
-
     try:
         if ctx.job.metadata:
-            meeting_data = json.loads(ctx.job.metadata)
-            phone_number = meeting_data.get("phone_number")
+            meeting_data = MeetingData.from_metadata(json.loads(ctx.job.metadata))
+            phone_number = meeting_data.phone_number
             logger.info(f"Extracted meeting data from job metadata: {meeting_data}")
         else:
             logger.error("No job metadata available")
@@ -410,23 +639,25 @@ async def entrypoint(ctx: JobContext):
         return
 
     # Get trunk ID from metadata if available, fallback to environment variable
-    trunk_id = meeting_data.get("sip_trunk_id") or outbound_trunk_id
+    trunk_id = meeting_data.sip_trunk_id or outbound_trunk_id
     if not trunk_id:
         logger.error("No SIP trunk ID configured in metadata or environment")
         ctx.shutdown()
         return
 
     # Get caller ID from metadata or environment variable
-    caller_id = meeting_data.get("caller_id") or twilio_caller_id
+    caller_id = meeting_data.caller_id or twilio_caller_id
     if not caller_id:
         logger.error("No caller ID configured. Set TWILIO_CALLER_ID environment variable with your authorized Twilio phone number")
         ctx.shutdown()
         return
 
-    logger.info(f"📱 Using caller ID: {caller_id}")
+    logger.debug("📱 Using caller ID: %s", caller_id)
 
     # Create the outbound reminder agent
     agent = OutboundReminderAgent(meeting_data)
+    if _SUPABASE_ENABLED:
+        ctx.add_shutdown_callback(agent.write_pending_history)
     participant_identity = phone_number
 
     # Create agent session with voice pipeline components
@@ -446,7 +677,7 @@ async def entrypoint(ctx: JobContext):
             model="sonic-2",
             voice="9626c31c-bec5-4cca-baa8-f8ba9e84c8bc",  # Professional voice
         ),
-        vad=silero.VAD.load(),
+        vad=ctx.proc.userdata["vad"],
     )
 
     # Start the session first before dialing, to ensure that when the user picks up
@@ -464,14 +695,6 @@ async def entrypoint(ctx: JobContext):
 
     # `create_sip_participant` starts dialing the user
     try:
-        logger.info(f"🔥 OUTBOUND CALL DEBUG - Starting call process")
-        logger.info(f"📞 Target: {phone_number}")
-        logger.info(f"🏢 Trunk ID: {trunk_id}")
-        logger.info(f"🏠 Room: {ctx.room.name}")
-        logger.info(f"👤 Participant Identity: {participant_identity}")
-        logger.info(f"🔗 LiveKit URL: {os.getenv('LIVEKIT_URL')}")
-
-        # Log the complete SIP request details
         sip_request = api.CreateSIPParticipantRequest(
             room_name=ctx.room.name,
             sip_trunk_id=trunk_id,
@@ -483,16 +706,14 @@ async def entrypoint(ctx: JobContext):
             wait_until_answered=True,
         )
 
-        logger.info(f"🛠️ SIP Request Details:")
-        logger.info(f"   room_name: {sip_request.room_name}")
-        logger.info(f"   sip_trunk_id: {sip_request.sip_trunk_id}")
-        logger.info(f"   sip_call_to: {sip_request.sip_call_to}")
-        logger.info(f"   sip_number: {sip_request.sip_number}")
-        logger.info(f"   participant_identity: {sip_request.participant_identity}")
-        logger.info(f"   participant_name: {sip_request.participant_name}")
-        logger.info(f"   wait_until_answered: {sip_request.wait_until_answered}")
-
-        logger.info(f"🚀 Creating SIP participant - initiating call...")
+        logger.info("🚀 Dialing %s via trunk %s in room %s", phone_number, trunk_id, ctx.room.name)
+        logger.debug(
+            "SIP request: room_name=%s sip_trunk_id=%s sip_call_to=%s sip_number=%s "
+            "participant_identity=%s participant_name=%s wait_until_answered=%s livekit_url=%s",
+            sip_request.room_name, sip_request.sip_trunk_id, sip_request.sip_call_to,
+            sip_request.sip_number, sip_request.participant_identity, sip_request.participant_name,
+            sip_request.wait_until_answered, os.getenv('LIVEKIT_URL'),
+        )
 
         # Create SIP participant with improved voicemail detection settings
         sip_task = asyncio.create_task(
@@ -501,13 +722,8 @@ async def entrypoint(ctx: JobContext):
 
         # Wait for SIP participant creation with a longer timeout since we're waiting for answer
         try:
-            logger.info(f"⏱️ Waiting for SIP participant creation (60s timeout)...")
             sip_participant = await asyncio.wait_for(sip_task, timeout=60.0)
-            logger.info(f"✅ SIP participant created successfully!")
-            logger.info(f"🎉 Customer answered! Call connected.")
-            logger.info(f"📊 SIP Participant Details:")
-            logger.info(f"   Identity: {sip_participant.participant_identity if hasattr(sip_participant, 'participant_identity') else 'N/A'}")
-            logger.info(f"   SIP Call ID: {sip_participant.sip_call_id if hasattr(sip_participant, 'sip_call_id') else 'N/A'}")
+            logger.info("🎉 Customer answered! SIP call ID: %s", getattr(sip_participant, 'sip_call_id', 'N/A'))
         except asyncio.TimeoutError:
             logger.error("❌ TIMEOUT: Call was not answered within 60 seconds")
             logger.error("   This could indicate:")
@@ -518,25 +734,23 @@ async def entrypoint(ctx: JobContext):
             ctx.shutdown()
             return
 
-        # Wait for the agent session start
-        await session_started
-
-        # Since wait_until_answered=True, the participant should be ready
+        # Wait for the agent session start and, since wait_until_answered=True,
+        # for the already-answered participant to show up, concurrently
         try:
-            participant = await asyncio.wait_for(
-                ctx.wait_for_participant(identity=participant_identity),
-                timeout=10.0  # Short timeout since call should already be answered
+            _, participant = await asyncio.gather(
+                session_started,
+                asyncio.wait_for(
+                    ctx.wait_for_participant(identity=participant_identity),
+                    timeout=10.0  # Short timeout since call should already be answered
+                ),
             )
             logger.info(f"Customer answered! Participant joined: {participant.identity}")
 
             agent.set_participant(participant)
 
-            # Wait briefly to detect if this is voicemail vs real person
-            logger.info("Waiting to detect if voicemail or real person...")
-            await asyncio.sleep(2.0)  # Give time for voicemail greeting to start
-
-            # Don't generate initial greeting immediately - let the person/voicemail speak first
-            # The agent will respond based on what it hears
+            # Don't generate an initial greeting - let the person/voicemail speak first.
+            # The session is already listening; the agent responds to what it hears and
+            # calls detected_answering_machine() if it's a voicemail greeting.
 
         except asyncio.TimeoutError:
             logger.info("Customer did not answer within 60 seconds - ending call")
@@ -555,15 +769,12 @@ async def entrypoint(ctx: JobContext):
         logger.error("   3. Confirm SIP credentials are correct")
         logger.error("   4. Check LiveKit → Twilio routing")
         ctx.shutdown()
-    except Exception as e:
-        logger.error(f"💥 UNEXPECTED ERROR during outbound call!")
-        logger.error(f"   Error type: {type(e).__name__}")
-        logger.error(f"   Error details: {str(e)}")
-        logger.error(f"   Phone: {phone_number}")
-        logger.error(f"   Trunk: {trunk_id}")
-        logger.error(f"   Room: {ctx.room.name}")
-        import traceback
-        logger.error(f"   Traceback: {traceback.format_exc()}")
+    except Exception:
+        # logger.exception appends the error type, details and traceback
+        logger.exception(
+            "💥 UNEXPECTED ERROR during outbound call! Phone: %s, Trunk: %s, Room: %s",
+            phone_number, trunk_id, ctx.room.name,
+        )
         ctx.shutdown()
 
 
@@ -571,6 +782,7 @@ if __name__ == "__main__":
     cli.run_app(
         WorkerOptions(
             entrypoint_fnc=entrypoint,
+            prewarm_fnc=prewarm,
             agent_name="outbound-caller",
         )
     )